@@ -1,49 +1,163 @@
 #!/usr/bin/env python3
 import argparse
+import os
+import sys
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 import hashlib
+import io
+import mmap
 import numpy
-import imagehash
 from PIL import Image
 import json
 from tqdm import tqdm
-import time
 import colorlog
+try:
+    # Optional, much faster JSON (de)serialization of large indexes
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    # Optional, much faster content hash (SIMD and multithreaded)
+    import blake3
+except ImportError:
+    blake3 = None
+try:
+    # Optional, non-cryptographic content hash that runs at memory bandwidth
+    import xxhash
+except ImportError:
+    xxhash = None
+
+logger = colorlog.getLogger(__name__)
+IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.svg')
 
-logger = None
 def is_image(filename):
-    f = str(filename).lower()
-    return f.endswith('.png') or f.endswith('.jpg') or \
-        f.endswith('.jpeg') or f.endswith('.bmp') or \
-        f.endswith('.gif') or f.endswith('.svg')
+    # endswith() checks the whole tuple in C; lowercase only as much of the
+    # path as the longest suffix needs, not all of it
+    return str(filename)[-5:].lower().endswith(IMAGE_SUFFIXES)
 
-def sha1sum(file_path):
-    sha1 = hashlib.sha1()
+# hashlib.file_digest (Python 3.11+) runs the read/update loop in C, letting
+# OpenSSL use its SHA-NI code path on large buffers without per-chunk overhead.
+HAS_FILE_DIGEST = hasattr(hashlib, 'file_digest')
+# Not available on macOS and Windows
+HAS_FADVISE = hasattr(os, 'posix_fadvise')
+
+# name is a hashlib algorithm name or a constructor of a hashlib-like object
+def _hashlib_digest(file_path, name, drop_cache=True):
+    with open(file_path, 'rb') as f:
+        if HAS_FADVISE:
+            # The file is read once, front to back: let the kernel read ahead further
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        if HAS_FILE_DIGEST:
+            digest = hashlib.file_digest(f, name)
+        else:
+            # Older Pythons: map the file and hash it in a single update() call,
+            # without allocating a bytes object per chunk. Mapping an empty
+            # file fails, and its digest is that of no data anyway.
+            digest = hashlib.new(name) if isinstance(name, str) else name()
+            if os.fstat(f.fileno()).st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    digest.update(mm)
+        if HAS_FADVISE and drop_cache:
+            # Won't be read again; don't let a tree walk evict everything else cached
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        return digest.hexdigest()
+
+def _blake3(file_path):
+    # update_mmap maps the file and hashes it with SIMD on all cores
+    return blake3.blake3(max_threads=blake3.blake3.AUTO).update_mmap(file_path).hexdigest()
+
+# Block size of the sha1-tree hash. Changing it changes every sha1-tree checksum.
+TREE_BLOCK = 4 << 20
+# Hashes the blocks of sha1-tree files, shared by all the hashing workers.
+# Its threads only hash, never wait on this executor, so they can't deadlock.
+BLOCK_EXECUTOR = None
+
+def block_executor():
+    global BLOCK_EXECUTOR
+    if BLOCK_EXECUTOR is None:
+        BLOCK_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count())
+    return BLOCK_EXECUTOR
+
+if hasattr(os, 'register_at_fork'):
+    # Image mode workers are forked; the threads of the parent's executor aren't
+    def _forget_block_executor():
+        global BLOCK_EXECUTOR
+        BLOCK_EXECUTOR = None
+    os.register_at_fork(after_in_child=_forget_block_executor)
+
+# SHA1 of the SHA1 digests of the file's TREE_BLOCK sized blocks. Unlike one
+# serial SHA1 chain, the blocks of a large file are hashed on all cores at once.
+def _sha1_tree(file_path):
+    with open(file_path, 'rb') as f:
+        fd = f.fileno()
+        def block_digest(offset):
+            # pread and hashlib both release the GIL
+            return hashlib.sha1(os.pread(fd, TREE_BLOCK, offset)).digest()
+        offsets = range(0, os.fstat(fd).st_size, TREE_BLOCK)
+        if len(offsets) <= 1:
+            # Nothing to parallelize; skip the executor round trip
+            digests = [block_digest(offset) for offset in offsets]
+        else:
+            digests = list(block_executor().map(block_digest, offsets))
+        return hashlib.sha1(b"".join(digests)).hexdigest()
+
+# Content hash algorithms. SHA1 is the default and the one B2 listings carry.
+# Indexes made with another algorithm are stored under their own file names,
+# see index_sufix(). SHA256 goes through OpenSSL, which uses the SHA-NI
+# instructions where the CPU has them; BLAKE3 needs the blake3 package.
+# XXH128 (xxhash package) isn't cryptographic, but it's plenty to tell file
+# contents apart and the fastest of all when the data is already cached.
+# SHA1-TREE hashes the blocks of a single large file in parallel, but its
+# checksums differ from plain SHA1 ones, see _sha1_tree().
+HASH_ALGOS = {
+    'sha1': partial(_hashlib_digest, name='sha1'),
+    'sha256': partial(_hashlib_digest, name='sha256'),
+    'blake3': _blake3,
+    'xxh128': partial(_hashlib_digest, name=xxhash.xxh3_128) if xxhash else None,
+    'sha1-tree': _sha1_tree,
+}
+
+def file_checksum(file_path, hash_algo='sha1'):
     try:
-        with open(file_path, 'rb') as f:
-            while chunk := f.read(8192):  # Read the file in chunks (8192 bytes at a time)
-                sha1.update(chunk)
+        return HASH_ALGOS[hash_algo](file_path)
     except PermissionError as e:
         logger.error(f"Skipping inaccessible file {file_path} due to missing permissions. Error: {e}")
         return None
     except Exception as e:
         logger.error(f"Skipping inaccessible file {file_path} due to: {e}")
         return None
-    return sha1.hexdigest()
 
-def ddhash(image, hash_size=8):
-	# type: (Image.Image, int) -> ImageHash
+def sha1sum(file_path):
+    return file_checksum(file_path, 'sha1')
+
+# Same as str(imagehash.ImageHash(bits)), but packs the bits with numpy
+# instead of building a '0'/'1' string in Python
+def bits_to_hex(bits):
+    bits = bits.ravel()
+    # packbits pads the last byte with zeros on the right; shift them back out
+    value = int.from_bytes(numpy.packbits(bits).tobytes(), 'big') >> (-bits.size % 8)
+    return '{:0{width}x}'.format(value, width=(bits.size + 3) // 4)
+
+def ddhash_pixels(image, hash_size=8):
+	# type: (Image.Image, int) -> numpy.ndarray
 	# resize(w, h), but numpy.array((h, w))
 	if hash_size < 2:
 		raise ValueError('Hash size must be greater than or equal to 2')
 
     # BILINEAR & 6 bits is pretty ok
     # HAMMING & 5 bits is perfect in the limited dataset
-	image = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.HAMMING)
-	pixels = numpy.asarray(image)
+	if image.mode != 'L':
+		image = image.convert('L')
+	image = image.resize((hash_size + 1, hash_size), Image.Resampling.HAMMING)
+	return numpy.asarray(image)
+
+def diff_hash(pixels):
 	# compute differences between columns
 	diff = pixels[:, 1:] > pixels[:, :-1]
-	return imagehash.ImageHash(diff)
+	return bits_to_hex(diff)
  
 """
 This function intends to hash files such that hashing is immune to multiples
@@ -52,72 +166,286 @@ It could be done by computing 4 hashes: 0deg, 90deg, ... 270deg and sorting. But
 hashings will be enough supposing we always start from the vertical orientation.
 """
 def dhash(file_path):
-    f = Image.open(file_path)
-    rotation = 0
-    hashes = [0, 0]
+    # Rotations by multiples of 90 degrees only move pixels around, so
+    # converting to grayscale first gives the very same result, and it's
+    # done once instead of per rotation, on a third of the data
+    f = Image.open(file_path).convert('L')
     if f.width > f.height:
         # Always rotate to vertical
-        rotation = 90
-    hashes[0] = str(ddhash(f.rotate(rotation, expand=True), hash_size=5))
-    hashes[1] = str(ddhash(f.rotate(rotation + 180, expand=True), hash_size=5))
+        f = f.rotate(90, expand=True)
+    pixels = ddhash_pixels(f, hash_size=5)
+    # The resampling filter is symmetric, so downscaling the image turned by
+    # 180 degrees gives the downscaled image turned by 180 degrees: flip the
+    # few pixels instead of resizing the whole image twice
+    hashes = [diff_hash(pixels), diff_hash(pixels[::-1, ::-1])]
     hashes.sort()
     return "".join(hashes)
 
-def index(dir, old_reversed, old_timestamps, image_mode, ignore_dir):
-    path = Path(dir)
-    if ignore_dir:
-        ignore_dir = [Path(dir[0]) for dir in ignore_dir]
-    dict = {}
-    total = len(list(path.rglob('*')))
-    for file_path in tqdm(path.rglob('*'), desc="Indexing files", total=total):  # '*' matches all files and directories
-        if ignore_dir:
-            skip = False
-            for dir in ignore_dir:
-                if file_path.resolve().is_relative_to(dir.resolve()):
-                    skip = True
-                    break
-            if skip:
-                continue
-        if file_path.is_file():
-            current_mod_time = file_path.stat().st_mtime
-            if old_timestamps and old_reversed and str(file_path) in old_timestamps and current_mod_time == old_timestamps[str(file_path)]:
-                logger.debug(f"{file_path} was last modified at {current_mod_time}, what matches the index. Reusing checksum")
-                checksum = old_reversed[str(file_path)]
-            else:
-                logger.debug(f"{file_path} was last modified at {current_mod_time}. Computing new checksum")
-                if image_mode and is_image(file_path):
-                    try:
-                        checksum = dhash(file_path)
-                        logger.debug(f"{file_path} checksums as image to {checksum}")
-                    except Exception as e:
-                        logger.warning(f"Failed to compute image hash for {file_path}: {e}. \n Falling back to SHA.")
-                        checksum = sha1sum(file_path)
-                else:
-                    checksum = sha1sum(file_path)
+def hash_file(file_path, image_mode, hash_algo='sha1'):
+    if image_mode and is_image(file_path):
+        try:
+            checksum = dhash(file_path)
+            logger.debug(f"{file_path} checksums as image to {checksum}")
+            return checksum
+        except Exception as e:
+            logger.warning(f"Failed to compute image hash for {file_path}: {e}. \n Falling back to {hash_algo}.")
+    return file_checksum(file_path, hash_algo)
+
+# Name of the image cache file kept next to the indexes, see load_image_cache().
+# It changes whenever the cache does, so it is left out of the index.
+IMAGE_CACHE = ".index_cache"
+
+# Content sha1 an image's checksum is cached under, see load_image_cache()
+def image_key(file_path):
+    try:
+        # On a cache miss the image is decoded right after; keep it in the page cache
+        return _hashlib_digest(file_path, 'sha1', drop_cache=False)
+    except Exception as e:
+        logger.error(f"Skipping inaccessible file {file_path} due to: {e}")
+        return None
+
+# hash_file() in image mode, also returning the content sha1 of an image for
+# the image cache (None for other files). The image is read only once.
+def hash_file_keyed(file_path, hash_algo='sha1'):
+    if not is_image(file_path):
+        return hash_file(file_path, True, hash_algo), None
+    try:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+    except PermissionError as e:
+        logger.error(f"Skipping inaccessible file {file_path} due to missing permissions. Error: {e}")
+        return None, None
+    except Exception as e:
+        logger.error(f"Skipping inaccessible file {file_path} due to: {e}")
+        return None, None
+    key = hashlib.sha1(data).hexdigest()
+    try:
+        checksum = dhash(io.BytesIO(data))
+        logger.debug(f"{file_path} checksums as image to {checksum}")
+        return checksum, key
+    except Exception as e:
+        logger.warning(f"Failed to compute image hash for {file_path}: {e}. \n Falling back to {hash_algo}.")
+    if hash_algo == 'sha1':
+        return key, key
+    return file_checksum(file_path, hash_algo), key
+
+# os.DirEntry of every file below root, those of a directory before its
+# subdirectories. os.scandir takes the file type from readdir, so telling
+# files from directories costs no stat. Symlinked directories aren't followed.
+def walk(root, ignore_dirs=None):
+    # Explicit stack like os.walk: no recursion limit on deep trees, and no
+    # chain of nested generators that every entry has to be passed through.
+    stack = [root]
+    while stack:
+        subdirs = []
+        dir = stack.pop()
+        try:
+            entries = os.scandir(dir)
+        except OSError as e:
+            # Like Path.rglob: an unreadable directory is skipped, not fatal
+            logger.error(f"Skipping inaccessible directory {dir} due to: {e}")
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if ignore_dirs and is_ignored(entry.path, ignore_dirs):
+                        continue
+                    subdirs.append(entry.path)
+                elif entry.is_file():
+                    if ignore_dirs and entry.is_symlink() and is_ignored(entry.path, ignore_dirs):
+                        continue
+                    yield entry
+        # Visit subdirectories in listing order
+        stack.extend(reversed(subdirs))
+
+def is_ignored(path, ignore_dirs):
+    resolved = Path(path).resolve()
+    return any(resolved.is_relative_to(dir) for dir in ignore_dirs)
+
+# Hashing threads mostly wait on I/O, so there are more of them than cores
+HASH_THREADS = 32
+# How many files ahead of the one being hashed to ask the kernel to prefetch
+PREFETCH_AHEAD = 64
+
+# Ask the kernel to start reading file_path in the background, so more reads
+# are in flight than there are workers
+def prefetch(file_path):
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except OSError:
+        # Only a hint; the worker reports real errors when it hashes the file
+        pass
 
-            if checksum is None:
-                continue
-            if checksum in dict:
-                dict[checksum].append(str(file_path))
+# Worker wrapper: hint the kernel about a later file, then hash this one
+def prefetch_and_hash(file_path, ahead, worker):
+    if ahead is not None:
+        prefetch(ahead)
+    return worker(file_path)
+
+# path -> checksum of all files in todo. Content hashes and file I/O release
+# the GIL, so they run in threads; image hashing holds it, so it uses processes.
+def hash_files(todo, image_mode, hash_algo='sha1', image_cache=None):
+    checksums = {}
+    # With an image cache, workers also return the content sha1 of each image
+    keyed = image_mode and image_cache is not None
+    if keyed and image_cache:
+        # Reading an image is much cheaper than decoding it: look images up by
+        # their content sha1 first, so moved or copied ones aren't decoded again.
+        # With nothing cached yet, every image would be a miss; skip this then.
+        images = [file_path for file_path in todo if is_image(file_path)]
+        with ThreadPoolExecutor(max_workers=HASH_THREADS) as executor:
+            results = executor.map(image_key, images)
+            keys = dict(zip(images, tqdm(results, desc="Checksumming images", total=len(images))))
+        for file_path, key in keys.items():
+            if key in image_cache:
+                checksums[file_path] = image_cache[key]
+        todo = [file_path for file_path in todo if file_path not in checksums]
+    if not todo:
+        return checksums
+    chunksize = 32
+    if image_mode:
+        executor = ProcessPoolExecutor(max_workers=os.cpu_count())
+        # Each process works through a whole chunk of paths in order
+        in_flight = os.cpu_count() * chunksize
+    else:
+        executor = ThreadPoolExecutor(max_workers=HASH_THREADS)
+        in_flight = HASH_THREADS
+    with executor:
+        # map() keeps the input order, which keeps the order of paths within
+        # each checksum stable. chunksize batches paths per IPC round trip;
+        # threads ignore it.
+        if keyed:
+            worker = partial(hash_file_keyed, hash_algo=hash_algo)
+        else:
+            worker = partial(hash_file, image_mode=image_mode, hash_algo=hash_algo)
+        if HAS_FADVISE:
+            # The worker for a file prefetches one far enough down the list
+            # that no worker has started on it yet, so the hint always comes
+            # before the read and never after the file was hashed and dropped.
+            distance = max(PREFETCH_AHEAD, in_flight)
+            ahead = todo[distance:] + [None] * min(distance, len(todo))
+            results = executor.map(partial(prefetch_and_hash, worker=worker), todo, ahead, chunksize=chunksize)
+        else:
+            results = executor.map(worker, todo, chunksize=chunksize)
+        for i, result in enumerate(tqdm(results, desc="Indexing files", total=len(todo))):
+            if keyed:
+                checksum, key = result
+                if key is not None and checksum is not None:
+                    image_cache[key] = checksum
             else:
-                dict[checksum] = [str(file_path)]
-    return dict
+                checksum = result
+            checksums[todo[i]] = checksum
+    return checksums
+
+# Resolved directories to skip, from the --ignore-dir arguments
+def resolve_ignore_dirs(ignore_dir):
+    if not ignore_dir:
+        return None
+    return [Path(dir[0]).resolve() for dir in ignore_dir]
+
+def index(dir, old_reversed, old_timestamps, image_mode, ignore_dir, hash_algo='sha1', image_cache=None):
+    # Normalize the same way pathlib does, so keys match indexes made with Path
+    root = str(Path(dir))
+    ignore_dir = resolve_ignore_dirs(ignore_dir)
+    if ignore_dir and is_ignored(root, ignore_dir):
+        return {}, {}
+    dict = defaultdict(list)
+    # Every file found, in traversal order, and path -> checksum for those known so far
+    files = []
+    checksums = {}
+    # path -> stat signature, taken during the walk; saves stat'ing every file again
+    signatures = {}
+    # Files whose checksum has to be computed
+    todo = []
+    for entry in tqdm(walk(root, ignore_dir), desc="Scanning files", unit=" files"):
+        if entry.name.startswith(IMAGE_CACHE):
+            continue
+        file_path = entry.path
+        files.append(file_path)
+        st = entry.stat()
+        signatures[file_path] = stat_signature(st)
+        if old_timestamps and old_reversed and file_path in old_timestamps and signature_matches(old_timestamps[file_path], st):
+            logger.debug(f"{file_path} was last modified at {st.st_mtime}, what matches the index. Reusing checksum")
+            checksums[file_path] = old_reversed[file_path]
+        else:
+            logger.debug(f"{file_path} was last modified at {st.st_mtime}. Computing new checksum")
+            todo.append(file_path)
+    checksums.update(hash_files(todo, image_mode, hash_algo, image_cache))
+
+    timestamps = {}
+    for file_path in files:
+        checksum = checksums[file_path]
+        if checksum is None:
+            continue
+        dict[checksum].append(file_path)
+        timestamps[file_path] = signatures[file_path]
+    return {checksum: paths for checksum, paths in dict.items()}, timestamps
+
+# Bytes at the start of a file compared before hashing all of it
+HEAD_SIZE = 4096
+
+def head_checksum(file_path):
+    try:
+        with open(file_path, 'rb') as f:
+            return hashlib.sha1(f.read(HEAD_SIZE)).hexdigest()
+    except Exception as e:
+        logger.error(f"Skipping inaccessible file {file_path} due to: {e}")
+        return None
+
+# Index only the files that can have a duplicate: those sharing their size and
+# first HEAD_SIZE bytes with another file. For finding duplicates, not validate.
+def index_size_bucketed(dir, ignore_dir, hash_algo='sha1'):
+    root = str(Path(dir))
+    ignore_dir = resolve_ignore_dirs(ignore_dir)
+    if ignore_dir and is_ignored(root, ignore_dir):
+        return {}
+    by_size = defaultdict(list)
+    for entry in tqdm(walk(root, ignore_dir), desc="Scanning files", unit=" files"):
+        by_size[entry.stat().st_size].append(entry.path)
+    # Files up to HEAD_SIZE are read whole anyway, so only larger ones get their head compared
+    large = [path for size, paths in by_size.items() if len(paths) > 1 and size > HEAD_SIZE for path in paths]
+    heads = {}
+    if large:
+        with ThreadPoolExecutor(max_workers=HASH_THREADS) as executor:
+            results = executor.map(head_checksum, large)
+            heads = dict(zip(large, tqdm(results, desc="Comparing file heads", total=len(large))))
+    todo = []
+    for size, paths in by_size.items():
+        if len(paths) < 2:
+            continue
+        if size > HEAD_SIZE:
+            count = Counter(heads[path] for path in paths)
+            paths = [path for path in paths if heads[path] is not None and count[heads[path]] > 1]
+        todo.extend(paths)
+    logger.info(f"{len(todo)} files share their size and head with another file, hashing them")
+    checksums = hash_files(todo, False, hash_algo)
+
+    index = defaultdict(list)
+    for file_path in todo:
+        checksum = checksums[file_path]
+        if checksum is not None:
+            index[checksum].append(file_path)
+    return dict(index)
 
 # Path -> sha
 def reverse_index(index):
-    reverse = {}
-    for sha in index:
-        for path in index[sha]:
-            reverse[path] = sha
-    return reverse
+    return {path: sha for sha, paths in index.items() for path in paths}
 
-def stamp_times(reverse_index):
-    timestamps = {}
-    for path in reverse_index:
-        path2 = Path(path)
-        current_mod_time = path2.stat().st_mtime
-        timestamps[path] = current_mod_time
-    return timestamps
+# What the timestamps index keeps per path: [mtime in ns, size, inode].
+# Same signature as last time means the file is taken as unchanged and
+# its checksum is reused instead of hashing the file again.
+def stat_signature(st):
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+def signature_matches(stored, st):
+    if isinstance(stored, list):
+        return stored == stat_signature(st)
+    # Indexes written before signatures were introduced hold plain st_mtime
+    return stored == st.st_mtime
 
 
 def serialize_to_json(data, file_path, prompt=True):
@@ -128,12 +456,39 @@ def serialize_to_json(data, file_path, prompt=True):
         confirm = input(f"File {file_path} already exists. Overwrite? (y/n): ")
         if confirm.lower() != 'y':
             print("Operation cancelled.")
-            return
+            return False
+
+    # Write the dictionary to a JSON file. Indexes are machine-read, so they
+    # are written compact: pretty-printing large ones is slow and bloats them.
+    # orjson refuses the surrogate escapes os.scandir gives undecodable
+    # filenames, so those indexes go through json, which escapes them.
+    payload = None
+    if orjson:
+        try:
+            payload = orjson.dumps(data)
+        except TypeError:
+            pass
+    if payload is not None:
+        path.write_bytes(payload)
+    else:
+        with path.open('w') as file:
+            json.dump(data, file, separators=(',', ':'))
+    logger.info(f"Index successfully written to {file_path}")
+    return True
 
-    # Write the dictionary to a JSON file
-    with path.open('w') as file:
-        json.dump(data, file, indent=4)
-        logger.info(f"Index successfully written to {file_path}")
+# Indexes loaded from JSON each hold their own copy of every path and sha.
+# Interning keeps one, and identical objects compare without reading characters.
+def intern_strings(data):
+    if not data:
+        return data
+    intern = sys.intern
+    # Values in one index are all of a kind: a path list, a sha or a timestamp
+    first = next(iter(data.values()))
+    if isinstance(first, str):
+        return {intern(key): intern(value) for key, value in data.items()}
+    if isinstance(first, list) and first and isinstance(first[0], str):
+        return {intern(key): [intern(v) for v in value] for key, value in data.items()}
+    return {intern(key): value for key, value in data.items()}
 
 def deserialize_from_json(file_path):
     path = Path(file_path)
@@ -146,27 +501,42 @@ def deserialize_from_json(file_path):
 
     # Read the JSON file and return the dictionary
     try:
-        with path.open('r') as file:
-            out = json.load(file)
+        try:
+            out = orjson.loads(path.read_bytes()) if orjson else None
+        except orjson.JSONDecodeError:
+            # Written by json with escaped surrogates, which orjson rejects
+            pass
+        if out is None:
+            with path.open('r') as file:
+                out = json.load(file)
     except Exception as e:
-        logger.error("Can't open the file: {e}")
+        logger.error(f"Can't open the file: {e}")
         return None
     
     if isinstance(out, dict):
         # This is an Indexer index, return it
-        return out
+        return intern_strings(out)
     elif isinstance(out, list):
-        return b2_listing_to_index(out)
+        return intern_strings(b2_listing_to_index(out))
     else:
         raise Exception("Unsupported format")
 
-def serialize_all(index, reverse_index, timestamp_index, dir, image_mode, prompt=True):
+def index_sufix(image_mode, hash_algo='sha1'):
     sufix = ""
     if image_mode:
-        logger.info(f"Serializing image mode indexes")
         sufix = "_dhash"
+    if hash_algo != 'sha1':
+        sufix += "_" + hash_algo
+    return sufix
+
+def serialize_all(index, reverse_index, timestamp_index, dir, image_mode, prompt=True, hash_algo='sha1'):
+    if image_mode:
+        logger.info(f"Serializing image mode indexes")
+    sufix = index_sufix(image_mode, hash_algo)
+    # Whether the index was written, and not cancelled at the prompt
+    written = False
     if index:
-        serialize_to_json(index, dir + "/.index" + sufix, prompt)
+        written = serialize_to_json(index, dir + "/.index" + sufix, prompt)
         logger.info(f"Serialized index with {len(index)} entries")
     if reverse_index:
         serialize_to_json(reverse_index, dir + "/.index_reversed" + sufix, prompt)
@@ -174,12 +544,12 @@ def serialize_all(index, reverse_index, timestamp_index, dir, image_mode, prompt
     if timestamp_index:
         serialize_to_json(timestamp_index, dir + "/.index_timestamps" + sufix, prompt)
         logger.info(f"Serialized timestamps index with {len(timestamp_index)} entries")
+    return written
 
-def deserialize_all(dir, image_mode):
-    sufix = ""
+def deserialize_all(dir, image_mode, hash_algo='sha1'):
     if image_mode:
         logger.info(f"Deserializing image mode indexes")
-        sufix = "_dhash"
+    sufix = index_sufix(image_mode, hash_algo)
     index = deserialize_from_json(dir + "/.index" + sufix)
     reverse_index = deserialize_from_json(dir + "/.index_reversed" + sufix)
     timestamp_index = deserialize_from_json(dir + "/.index_timestamps" + sufix)
@@ -188,49 +558,71 @@ def deserialize_all(dir, image_mode):
     logger.info(f"Deserialized timestamps index with {len(timestamp_index)} entries")
     return index, reverse_index, timestamp_index
 
+# Image mode caches content sha1 -> image checksum next to its index, which
+# spares decoding images that were moved or copied since the last run
+def load_image_cache(dir, hash_algo='sha1'):
+    path = dir + "/" + IMAGE_CACHE + index_sufix(True, hash_algo)
+    if not os.path.exists(path):
+        return {}
+    return deserialize_from_json(path) or {}
+
+def save_image_cache(image_cache, index, dir, hash_algo='sha1'):
+    # Drop the entries of images that are gone from the tree
+    image_cache = {key: checksum for key, checksum in image_cache.items() if checksum in index}
+    serialize_to_json(image_cache, dir + "/" + IMAGE_CACHE + index_sufix(True, hash_algo), prompt=False)
+
+# index without the given paths, filtered per sha like strip_unchanged, so a
+# path listed under several shas or more than once is kept every time.
+# Shas left without paths are dropped.
+def without_paths(index, paths):
+    stripped = {}
+    for sha, sha_paths in index.items():
+        kept = [path for path in sha_paths if path not in paths]
+        if kept:
+            stripped[sha] = kept
+    return stripped
+
 # Return arrays current_stripped, old_stripped such that
 # every SHA:filename pair present in both current and old
 # is removed.
 def strip_unchanged(current, old):
+    # Per-sha sets make each membership check O(1), also for shas shared by
+    # many paths. Unlike a path -> sha map, they keep a path that is listed
+    # under several shas (e.g. versions in a B2 listing).
+    current_sets = {sha: set(paths) for sha, paths in current.items()}
+    old_sets = {sha: set(paths) for sha, paths in old.items()}
     old_stripped = {}
     current_stripped = {}
     for sha in old:
-        new_sha = [x for x in old[sha] if sha not in current or x not in current[sha]]
+        if old_sets[sha] == current_sets.get(sha):
+            # Same paths on both sides, nothing left of this sha
+            continue
+        new_sha = [x for x in old[sha] if x not in current_sets.get(sha, ())]
         if len(new_sha) != 0:
             old_stripped[sha] = new_sha
     for sha in current:
-        new_sha = [x for x in current[sha] if sha not in old or x not in old[sha]]
+        if current_sets[sha] == old_sets.get(sha):
+            continue
+        new_sha = [x for x in current[sha] if x not in old_sets.get(sha, ())]
         if len(new_sha) != 0:
             current_stripped[sha] = new_sha
     return current_stripped, old_stripped
 
 # Strip easy cases of content change.
 def strip_content_changes(current, old):
-    old_stripped = {}
-    current_stripped = {}
-    # Dict of path -> [old sha, new sha]
-    content_changes = {}
     current_paths_to_sha = reverse_index(current)
-    for sha in old:
-        for path in old[sha]:
-            if path in current_paths_to_sha and sha != current_paths_to_sha[path]:
-                content_changes[path] = [sha, current_paths_to_sha[path]]
-    
+    # Dict of path -> [old sha, new sha]. Old is walked per sha rather than
+    # inverted, so each sha a path is listed under in old gets compared.
+    content_changes = {}
+    for sha, paths in old.items():
+        for path in paths:
+            current_sha = current_paths_to_sha.get(path)
+            if current_sha is not None and current_sha != sha:
+                content_changes[path] = [sha, current_sha]
+
     # Recreate indexes without pairs listed in content_changes.
-    for sha in old:
-        for path in old[sha]:
-            if path not in content_changes:
-                if sha in old_stripped:
-                    old_stripped[sha].append(path)
-                else:
-                    old_stripped[sha] = [path]
-    for sha in current:
-        for path in current[sha]:
-            if path not in content_changes:
-                if sha in current_stripped:
-                    current_stripped[sha].append(path)
-                else:
-                    current_stripped[sha] = [path]
+    old_stripped = without_paths(old, content_changes)
+    current_stripped = without_paths(current, content_changes)
     return current_stripped, old_stripped, content_changes
 
 # Strip easy cases of moves/renames.
@@ -239,48 +631,37 @@ def strip_moves(current, old):
     current_stripped = {}
     # Dict of sha -> [[old path, new path], ...]
     moves = {}
-    # Helper dict of sha -> [oldpath1, oldpath2...]
-    skiplist_old = {}
-    # Helper dict of sha -> [newpath1, newpath2...]
-    skiplist_current = {}
-    current_paths_to_sha = reverse_index(current)
-    for sha in old:
-        if sha in current:
-            for i in range(min(len(old[sha]), len(current[sha]))):
-                if sha not in moves:
-                    moves[sha] = [[old[sha][i], current[sha][i]]]
-                    skiplist_old[sha] = [old[sha][i]]
-                    skiplist_current[sha] = [current[sha][i]]
-                else:
-                    moves[sha].append([old[sha][i], current[sha][i]])
-                    skiplist_old[sha].append(old[sha][i])
-                    skiplist_current[sha].append(current[sha][i])
-    
-    # Recreate indexes without pairs listed in content_changes.
-    for sha in old:
-        for path in old[sha]:
-            if sha in skiplist_old and path in skiplist_old[sha]:
-                continue
-            if sha in old_stripped:
-                old_stripped[sha].append(path)
-            else:
-                old_stripped[sha] = [path]
-    for sha in current:
-        for path in current[sha]:
-            if sha in skiplist_current and path in skiplist_current[sha]:
-                continue
-            if sha in current_stripped:
-                current_stripped[sha].append(path)
-            else:
-                current_stripped[sha] = [path]
+    # Paths of a sha found on both sides are paired up in order, with zip
+    # instead of a lookup per path. The longer side keeps its surplus.
+    for sha, old_paths in old.items():
+        current_paths = current.get(sha, ())
+        if old_paths and current_paths:
+            moves[sha] = [[old_path, current_path] for old_path, current_path in zip(old_paths, current_paths)]
+        rest = unpaired(old_paths, len(current_paths))
+        if rest:
+            old_stripped[sha] = rest
+    for sha, current_paths in current.items():
+        rest = unpaired(current_paths, len(old.get(sha, ())))
+        if rest:
+            current_stripped[sha] = rest
     return current_stripped, old_stripped, moves
 
+# Paths left of a sha once its first n paths are paired as moves. A path
+# listed more than once goes with its first occurrence.
+def unpaired(paths, n):
+    if len(paths) <= n:
+        return []
+    if n == 0:
+        return list(paths)
+    paired = set(paths[:n])
+    return [path for path in paths[n:] if path not in paired]
+
 # Strip easy cases of removal. Assumption: content changes, moves are already removed.
 def strip_removal(current, old):
     old_stripped = {}
     # Dict of sha -> [old paths]
     removals = {}
-    for sha in old:
+    for sha, paths in old.items():
         if sha not in current:
             # It may be an actual removal, but something else is also possible.
             # Consider input:
@@ -290,20 +671,10 @@ def strip_removal(current, old):
             # old: [sha1 -> f2]
             # current []
             # It's a "removal" but of a duplicate. 
-            for path in old[sha]:
-                if sha in removals:
-                    removals[sha].append(path)
-                else:
-                    removals[sha] = [path]
-    
-    # Recreate indexes without pairs listed in content_changes.
-    for sha in old:
-        for path in old[sha]:
-            if sha not in removals:
-                if sha in old_stripped:
-                    old_stripped[sha].append(path)
-                else:
-                    old_stripped[sha] = [path]
+            if paths:
+                removals[sha] = list(paths)
+        elif paths:
+            old_stripped[sha] = list(paths)
     return current, old_stripped, removals
 
 # Strip easy cases of copies or new files. Assumption: content changes, moves, removals are already removed.
@@ -319,12 +690,9 @@ def strip_copy_or_new(current, old, old_orig):
         if sha not in old:
             # All paths in current[sha] are new or copies
             if sha in old_orig:
-                # It's a copy. Append to the copies dict
-                for path in current[sha]:
-                    if sha in copies:
-                        copies[sha][1].append(path)
-                    else:
-                        copies[sha] = [old_orig[sha][0], [path]]
+                # It's a copy. Each sha comes up once, so all its paths go in at once
+                if current[sha]:
+                    copies[sha] = [old_orig[sha][0], list(current[sha])]
             else:
                 # It's a new file(s)
                 new[sha] = current[sha]
@@ -354,17 +722,14 @@ def strip_copy_or_new(current, old, old_orig):
     # old index can be returned as-is, because:
     #   1. File that was copied is removed as unchanged
     #   2. File that's new resides only in current index
+    # Every path of a sha goes to either new or copies, so a whole sha is
+    # skipped with a dict lookup instead of scanning its list of paths.
+    # A sha left without paths isn't kept either.
     current_stripped = {}
     for sha in current:
-        for path in current[sha]:
-            if sha in new and path in new[sha]:
-                continue
-            if sha in copies and path in copies[sha][1]:
-                continue
-            if sha in current_stripped:
-                current_stripped[sha].append(path)
-            else:
-                current_stripped[sha] = [path]
+        if sha in new or sha in copies or not current[sha]:
+            continue
+        current_stripped[sha] = list(current[sha])
     return current_stripped, old, copies, new
 
 class ChangeDescription:
@@ -388,53 +753,102 @@ class ChangeDescription:
             f"  new: {self.new}\n"
         )
 
-def strip(current, old):
-    debug = False
+# Run the strip steps one after another, each on what the previous one left
+def strip_steps(current, old):
     change_descr = ChangeDescription()
     change_descr.current_stripped, change_descr.old_stripped = strip_unchanged(current, old)
-    if (debug):
-        logger.debug(f"Stripped unchanged {change_descr}")
     change_descr.current_stripped, change_descr.old_stripped, change_descr.content_changes = strip_content_changes(change_descr.current_stripped, change_descr.old_stripped)
-    if (debug):
-        logger.debug(f"Stripped content changes {change_descr}")
     change_descr.current_stripped, change_descr.old_stripped, change_descr.moves = strip_moves(change_descr.current_stripped, change_descr.old_stripped)
-    if (debug):
-        logger.debug(f"Stripped moves {change_descr}")
     change_descr.current_stripped, change_descr.old_stripped, change_descr.removals = strip_removal(change_descr.current_stripped, change_descr.old_stripped)
-    if (debug):
-        logger.debug(f"Stripped removals {change_descr}")
     change_descr.current_stripped, change_descr.old_stripped, change_descr.copies, change_descr.new = strip_copy_or_new(change_descr.current_stripped, change_descr.old_stripped, old)
+    return change_descr
+
+# Same result as strip_steps(), classifying every path in a single sweep
+# instead of rebuilding both indexes after each step. Needs each path listed
+# once; otherwise (e.g. B2 listings with versions) strip_steps() is used.
+def strip(current, old):
+    debug = False
+    change_descr = ChangeDescription()
+    if current == old:
+        # Nothing changed at all: the common case of re-validating a tree
+        return change_descr
+    # Shas listing exactly the same paths on both sides hold nothing but
+    # unchanged files. In a mostly unchanged tree that's nearly all of them,
+    # so drop them up front (list comparison runs in C) and invert the rest.
+    same = {sha for sha in current.keys() & old.keys() if current[sha] == old[sha]}
+    current_rest = {sha: paths for sha, paths in current.items() if sha not in same}
+    old_rest = {sha: paths for sha, paths in old.items() if sha not in same}
+    current_paths_to_sha = reverse_index(current_rest)
+    old_paths_to_sha = reverse_index(old_rest)
+    if len(current_paths_to_sha) != sum(map(len, current_rest.values())) or \
+            len(old_paths_to_sha) != sum(map(len, old_rest.values())):
+        # Some path is listed more than once
+        return strip_steps(current, old)
+
+    # Paths that exist on one side only, sha -> [paths], in index order
+    old_only = defaultdict(list)
+    current_only = defaultdict(list)
+    for path, sha in old_paths_to_sha.items():
+        current_sha = current_paths_to_sha.get(path)
+        if current_sha is None:
+            old_only[sha].append(path)
+        elif current_sha != sha:
+            change_descr.content_changes[path] = [sha, current_sha]
+    for path, sha in current_paths_to_sha.items():
+        if path not in old_paths_to_sha:
+            current_only[sha].append(path)
+
+    # Pair old and current paths of the same sha as moves, in order. The
+    # remaining old paths were removed; remaining current paths are handled below.
+    for sha, old_paths in old_only.items():
+        current_paths = current_only.get(sha, [])
+        moved = min(len(old_paths), len(current_paths))
+        if moved:
+            change_descr.moves[sha] = [[old_paths[i], current_paths[i]] for i in range(moved)]
+            current_only[sha] = current_paths[moved:]
+        if len(old_paths) > moved:
+            change_descr.removals[sha] = old_paths[moved:]
+
+    # Whatever is left in current was copied from a file known in old, or is new
+    for sha, paths in current_only.items():
+        if not paths:
+            continue
+        if sha in old:
+            change_descr.copies[sha] = [old[sha][0], paths]
+        else:
+            change_descr.new[sha] = paths
     if (debug):
-        logger.debug(f"Stripped copies and new {change_descr}")
+        logger.debug(f"Stripped {change_descr}")
     return change_descr
 
 def compare(current, old):
     change_descr = strip(current, old)
+    # Format everything first and write it out at once; on large diffs a
+    # print() per line is dominated by call and flush overhead.
+    lines = []
     for sha in change_descr.moves:
-        for old_path, new_path in change_descr.moves[sha]:
-            print(f"File {old_path} moved to {new_path}.")
-    for path in change_descr.content_changes:
-        print(f"File {path} changed its contents.")
+        lines.extend(f"File {old_path} moved to {new_path}.\n" for old_path, new_path in change_descr.moves[sha])
+    lines.extend(f"File {path} changed its contents.\n" for path in change_descr.content_changes)
     for sha in change_descr.removals:
         for path in change_descr.removals[sha]:
             # This path is gone. However, it may be either a duplicate removed, or an actual removal.
             if sha in current:
                 # Duplicate was removed
                 if len(current[sha]) == 1:
-                    print(f"Duplicated file {path} was removed. Its copy exists at {current[sha][0]}")
+                    lines.append(f"Duplicated file {path} was removed. Its copy exists at {current[sha][0]}\n")
                 else:
                     copies = ", ".join(current[sha])
-                    print(f"Duplicated file {path} was removed. Its copies exist at {copies}")
+                    lines.append(f"Duplicated file {path} was removed. Its copies exist at {copies}\n")
             else:
-                print(f"File {path} was removed.")
+                lines.append(f"File {path} was removed.\n")
     for sha in change_descr.new:
-        for path in change_descr.new[sha]:
-            print(f"File {path} is new.")
+        lines.extend(f"File {path} is new.\n" for path in change_descr.new[sha])
     for sha in change_descr.copies:
         oldpath = change_descr.copies[sha][0]
         newpaths = change_descr.copies[sha][1]
-        for path in newpaths:
-            print(f"File {oldpath} was copied to {path}.")
+        lines.extend(f"File {oldpath} was copied to {path}.\n" for path in newpaths)
+    sys.stdout.write("".join(lines))
+    sys.stdout.flush()
     return change_descr
 
 """
@@ -475,33 +889,25 @@ Index:
     ],
 """
 def b2_listing_to_index(b2_listing):
-    index = {}
+    index = defaultdict(list)
     logger.info(f"Converting b2 listing to an index...")
-    count = 0
+    # Entries without a name or SHA1 are collected and reported once the
+    # listing is converted, keeping the hot loop free of logging.
+    malformed = []
     for file in b2_listing:
-        if "contentSha1" not in file:
-            logger.warning("No contentSha1 in b2 listing:")
-            print(file)
-            continue
-        if "fileName" not in file:
-            logger.warning("No contentSha1 in b2 listing:")
-            print(file)
-            continue
-        sha = file["contentSha1"]
+        sha = file.get("contentSha1")
         if sha == "none":
-            try:
-                sha = file["fileInfo"]["large_file_sha1"]
-            except Exception as e:
-                logger.error(f"Failed to read SHA1 for {file['fileName']}: {e}")
-                continue
-        path = file["fileName"]
-        if sha in index:
-            index[sha].append(path)
-        else:
-            index[sha] = [path]
-        count += 1
-    logger.info(f"Done, {count} entries added.")
-    return index
+            # Large files uploaded in parts carry their SHA1 in fileInfo
+            sha = (file.get("fileInfo") or {}).get("large_file_sha1")
+        path = file.get("fileName")
+        if sha is None or path is None:
+            malformed.append(file)
+            continue
+        index[sha].append(path)
+    for file in malformed:
+        logger.warning(f"Skipping b2 listing entry without fileName or SHA1: {file}")
+    logger.info(f"Done, {len(b2_listing) - len(malformed)} entries added.")
+    return dict(index)
 
 def list_duplicates(current, print_as_array):
     duplicates = []
@@ -514,14 +920,15 @@ def list_duplicates(current, print_as_array):
     if print_as_array:
         print(duplicates)
 
-change_descr = None
-def main():
-    global logger
-    logger = colorlog.getLogger(__name__)
-    handler = colorlog.StreamHandler()
-    formatter = colorlog.ColoredFormatter('%(log_color)s%(levelname)-8s%(reset)s %(white)s%(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+# argv defaults to the command line. Returns the exit code, so that main()
+# can also be called in-process, e.g. from tests.
+def main(argv=None):
+    if not logger.handlers:
+        # Only once per process, however many times main() is called
+        handler = colorlog.StreamHandler()
+        formatter = colorlog.ColoredFormatter('%(log_color)s%(levelname)-8s%(reset)s %(white)s%(message)s')
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
     logger.setLevel(colorlog.INFO)
 
     parser = argparse.ArgumentParser(description="Indexing your files, and validating if you've lost anything.")
@@ -534,6 +941,8 @@ def main():
                                     help="Use hashing dedicated for images. This treats similar images as same files.")
     index_parser.add_argument("--ignore-dir", type=str, action='append', nargs='*',
                                     help="Ignore the specified directory while indexing")
+    index_parser.add_argument("--hash", choices=HASH_ALGOS.keys(), default='sha1',
+                                    help="Content hash to use. Indexes made with different hashes are stored separately. Default: sha1")
 
     # Subparser for the 'duplicate-info'
     duplicate_parser = subparsers.add_parser("duplicate-info", help="List info about duplicates in current tree")
@@ -542,8 +951,12 @@ def main():
                                     help="Use hashing dedicated for images. This treats similar images as same files.")
     duplicate_parser.add_argument("--print-as-array", action='store_true',
                                     help="Print in the format of Python array. Easy to process further.")
+    duplicate_parser.add_argument("--scan", action='store_true',
+                                    help="Scan the directory now instead of reading the existing index. Only files sharing their size with another file get hashed.")
     duplicate_parser.add_argument("--ignore-dir", type=str, action='append', nargs='*',
                                     help="Ignore the specified directory while indexing")
+    duplicate_parser.add_argument("--hash", choices=HASH_ALGOS.keys(), default='sha1',
+                                    help="Content hash to use. Indexes made with different hashes are stored separately. Default: sha1")
 
     # Subparser for the 'validate' command
     validate_parser = subparsers.add_parser("validate", help="Validate the files in the directory")
@@ -560,44 +973,61 @@ def main():
                                     help="Use hashing dedicated for images. This treats similar images as same files.")
     validate_parser.add_argument("--checksum", action='store_true',
                                     help="Always do checksum, don't rely on modification times.")
+    validate_parser.add_argument("--hash", choices=HASH_ALGOS.keys(), default='sha1',
+                                    help="Content hash to use. Indexes made with different hashes are stored separately. Default: sha1")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.hash == 'blake3' and blake3 is None:
+        parser.error("--hash blake3 requires the blake3 package")
+    if args.hash == 'xxh128' and xxhash is None:
+        parser.error("--hash xxh128 requires the xxhash package")
 
     # Perform the operation
     if args.operation == "index":
-        d = index(args.directory, None, None, args.image_mode, args.ignore_dir)
+        image_cache = load_image_cache(args.directory, args.hash) if args.image_mode else None
+        d, t = index(args.directory, None, None, args.image_mode, args.ignore_dir, args.hash, image_cache)
         r = reverse_index(d)
-        t = stamp_times(r)
-        serialize_all(d, r, t, args.directory, args.image_mode)
+        written = serialize_all(d, r, t, args.directory, args.image_mode, hash_algo=args.hash)
+        if args.image_mode and written:
+            save_image_cache(image_cache, d, args.directory, args.hash)
     elif args.operation =="validate":
         if args.baseline:
             old = deserialize_from_json(args.baseline)
             old_reversed = deserialize_from_json(args.baseline + "_reversed")
             old_timestamps = deserialize_from_json(args.baseline + "_timestamps")
         else:
-            old, old_reversed, old_timestamps = deserialize_all(args.directory, args.image_mode)
+            old, old_reversed, old_timestamps = deserialize_all(args.directory, args.image_mode, args.hash)
         if args.target:
             current = deserialize_from_json(args.target)
         else:
             if args.checksum:
                 old_reversed = None
                 old_timestamps = None
-            current = index(args.directory, old_reversed, old_timestamps, args.image_mode, args.ignore_dir)
-        change_descr = compare(current, old)
+            image_cache = load_image_cache(args.directory, args.hash) if args.image_mode else None
+            current, current_timestamps = index(args.directory, old_reversed, old_timestamps, args.image_mode, args.ignore_dir, args.hash, image_cache)
+        compare(current, old)
         if not args.target and not args.script:
             print("Overwrite old index? [y/N] ", end='')
             choice = input().lower()
             if choice == "y":
                 r = reverse_index(current)
-                t = stamp_times(r)
-                serialize_all(current, r, t, args.directory, args.image_mode, prompt=False)
+                serialize_all(current, r, current_timestamps, args.directory, args.image_mode, prompt=False, hash_algo=args.hash)
+                if args.image_mode:
+                    save_image_cache(image_cache, current, args.directory, args.hash)
             else:
                 print("Ok, not doing anything.")
     elif args.operation == "duplicate-info":
+        if args.scan:
+            if args.image_mode:
+                parser.error("--scan can't be combined with --image-mode: similar images differ in size")
+            current = index_size_bucketed(args.directory, args.ignore_dir, args.hash)
+            list_duplicates(current, args.print_as_array)
+            return 0
         logger.warning("Listing duplicates based on existing index! Current directory may be different. Confirm with 'validate' if you like.")
-        old, old_reversed, old_timestamps = deserialize_all(args.directory, args.image_mode)
+        old, old_reversed, old_timestamps = deserialize_all(args.directory, args.image_mode, args.hash)
         list_duplicates(old, args.print_as_array)
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
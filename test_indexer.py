@@ -1,8 +1,39 @@
 import unittest
+import os
+import io
+import re
+import json
+import importlib.util
+import contextlib
 import subprocess
 from pathlib import Path
 import tempfile
-from indexer import strip_content_changes, strip_moves, strip_unchanged, strip_removal, strip_copy_or_new, strip, ChangeDescription
+import hashlib
+from unittest import mock
+from indexer import strip_content_changes, strip_moves, strip_unchanged, strip_removal, strip_copy_or_new, strip, ChangeDescription, stat_signature, signature_matches, file_checksum, index, sha1sum, main, walk, bits_to_hex, dhash, b2_listing_to_index
+
+# Run the indexer CLI in this process, which saves an interpreter startup
+# and all imports per call. Returns what subprocess.run() would.
+def run_indexer(*args):
+    stdout = io.StringIO()
+    with contextlib.redirect_stdout(stdout):
+        returncode = main(list(args))
+    return subprocess.CompletedProcess(["indexer.py", *args], returncode, stdout.getvalue())
+
+# Large file without building its contents in memory: a short head telling
+# files apart, extended with zeros (sparse where the filesystem allows it).
+def make_file(path, size, head):
+    path.write_bytes(head)
+    os.truncate(path, size)
+
+# Small file written with bare os calls, skipping Path's text file object and codec.
+# Meant for tests that create many small files.
+def write_file(path, data):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
 
 class TestRemovalIsolated(unittest.TestCase):
     def test_removal_simple(self):
@@ -94,6 +125,17 @@ class TestContentChangeIsolated(unittest.TestCase):
         self.assertEqual(a, c)
         self.assertEqual(b, d)
         self.assertEqual(len(f), 0)
+    def test_content_change_multiple_shas(self):
+        # A path listed under several shas (B2 listing with versions) is kept under each of them
+        current, old, changes = strip_content_changes({}, {'A': ['p'], 'B': ['p']})
+        self.assertEqual(current, {})
+        self.assertEqual(old, {'A': ['p'], 'B': ['p']})
+        self.assertEqual(changes, {})
+        # Every old sha of a path is compared; the last one differing is reported
+        current, old, changes = strip_content_changes({'C': ['p'], 'D': ['q']}, {'A': ['p', 'q'], 'B': ['p']})
+        self.assertEqual(current, {})
+        self.assertEqual(old, {})
+        self.assertEqual(changes, {'p': ['B', 'C'], 'q': ['A', 'D']})
 class TestCopyOrNewIsolated(unittest.TestCase):
     def test_new_simple(self):
         current = {'bcd': ['f3']}
@@ -187,6 +229,195 @@ class TestFullStrip(unittest.TestCase):
         self.assertEqual(change_descr.copies, {})
         self.assertEqual(change_descr.moves, {})
         self.assertEqual(change_descr.content_changes, {})
+    def test_fullstrip_matches_steps(self):
+        current = {'bcd': ['f3'], 'sha1': ['d1/f1', 'd2/f1'], 'sha3': ['f2', 'f8'], 'sha4': ['f4', 'f5', 'f6'], 'sha6': ['f9']}
+        old = {'sha1': ['f1'], 'sha2': ['f2'], 'sha3': ['f10'], 'sha4': ['f4', 'f5'], 'sha5': ['f7', 'f9']}
+        change_descr = strip(current, old)
+        c, o = strip_unchanged(current, old)
+        c, o, content_changes = strip_content_changes(c, o)
+        c, o, moves = strip_moves(c, o)
+        c, o, removals = strip_removal(c, o)
+        c, o, copies, new = strip_copy_or_new(c, o, old)
+        self.assertEqual(change_descr.current_stripped, c)
+        self.assertEqual(change_descr.old_stripped, o)
+        self.assertEqual(change_descr.content_changes, content_changes)
+        self.assertEqual(change_descr.moves, moves)
+        self.assertEqual(change_descr.removals, removals)
+        self.assertEqual(change_descr.copies, copies)
+        self.assertEqual(change_descr.new, new)
+    def test_fullstrip_multiple_shas(self):
+        # Paths listed under several shas, as in a B2 listing with versions
+        change_descr = strip({'s1': ['p0']}, {'s0': ['p2'], 's1': ['p2']})
+        self.assertEqual(change_descr.moves, {'s1': [['p2', 'p0']]})
+        self.assertEqual(change_descr.removals, {'s0': ['p2']})
+        self.assertEqual(change_descr.content_changes, {})
+        self.assertEqual(change_descr.copies, {})
+        self.assertEqual(change_descr.new, {})
+        change_descr = strip({'A': ['p', 'q'], 'C': ['r']}, {'A': ['p'], 'B': ['p', 's']})
+        self.assertEqual(change_descr.moves, {})
+        self.assertEqual(change_descr.removals, {'B': ['p', 's']})
+        self.assertEqual(change_descr.content_changes, {})
+        self.assertEqual(change_descr.copies, {'A': ['p', ['q']]})
+        self.assertEqual(change_descr.new, {'C': ['r']})
+        self.assertEqual(change_descr.current_stripped, {})
+        self.assertEqual(change_descr.old_stripped, {})
+class TestB2Listing(unittest.TestCase):
+    def convert(self, listing):
+        # Returns the index, the warnings logged and whatever went to stdout
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout), self.assertLogs('indexer', level='INFO') as logs:
+            index = b2_listing_to_index(listing)
+        return index, [line for line in logs.output if line.startswith("WARNING")], stdout.getvalue()
+    def test_plain(self):
+        index, warnings, stdout = self.convert([
+            {"fileName": "dir/f1", "contentSha1": "aaa"},
+            {"fileName": "f2", "contentSha1": "aaa"},
+            {"fileName": "f3", "contentSha1": "bbb"},
+        ])
+        self.assertEqual(index, {"aaa": ["dir/f1", "f2"], "bbb": ["f3"]})
+        self.assertEqual(warnings, [])
+        self.assertEqual(stdout, "")
+    def test_large_file(self):
+        # Files uploaded in parts carry their SHA1 in fileInfo
+        index, warnings, stdout = self.convert([
+            {"fileName": "big", "contentSha1": "none", "fileInfo": {"large_file_sha1": "ccc"}},
+        ])
+        self.assertEqual(index, {"ccc": ["big"]})
+        self.assertEqual(warnings, [])
+    def test_malformed(self):
+        index, warnings, stdout = self.convert([
+            {"fileName": "big", "contentSha1": "none"},
+            {"contentSha1": "ddd"},
+            {"fileName": "f1", "contentSha1": "aaa"},
+        ])
+        self.assertEqual(index, {"aaa": ["f1"]})
+        self.assertEqual(len(warnings), 2)
+        self.assertIn("'big'", warnings[0])
+        self.assertIn("'ddd'", warnings[1])
+        # Reported through the logger, not mixed into the report on stdout
+        self.assertEqual(stdout, "")
+class TestStatSignature(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file = Path(self.temp_dir.name) / "file1"
+        self.file.write_text("hello world")
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    def test_signature_unchanged(self):
+        signature = stat_signature(self.file.stat())
+        self.assertTrue(signature_matches(signature, self.file.stat()))
+    def test_signature_size_changed(self):
+        st = self.file.stat()
+        signature = stat_signature(st)
+        self.file.write_text("hello world!")
+        os.utime(self.file, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertFalse(signature_matches(signature, self.file.stat()))
+    def test_signature_legacy_mtime(self):
+        st = self.file.stat()
+        self.assertTrue(signature_matches(st.st_mtime, st))
+        self.assertFalse(signature_matches(st.st_mtime - 1, st))
+class TestWalk(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        (self.root / "sub" / "deeper").mkdir(parents=True)
+        (self.root / "file1").write_text("1")
+        (self.root / "sub" / "file2").write_text("2")
+        (self.root / "sub" / "deeper" / "file3").write_text("3")
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    def paths(self, ignore_dirs=None):
+        return [entry.path for entry in walk(str(self.root), ignore_dirs)]
+    def test_walk_order(self):
+        self.assertEqual(self.paths(), [str(self.root / "file1"), str(self.root / "sub" / "file2"),
+                                        str(self.root / "sub" / "deeper" / "file3")])
+    def test_walk_unreadable_dir(self):
+        locked = str(self.root / "sub")
+        scandir = os.scandir
+        def deny(path):
+            if str(path) == locked:
+                raise PermissionError(13, "Permission denied", path)
+            return scandir(path)
+        with mock.patch("os.scandir", deny), self.assertLogs('indexer', level='ERROR') as logs:
+            self.assertEqual(self.paths(), [str(self.root / "file1")])
+        self.assertIn(locked, logs.output[0])
+    def test_walk_ignore_dir(self):
+        self.assertEqual(self.paths([(self.root / "sub").resolve()]), [str(self.root / "file1")])
+        self.assertEqual(self.paths([(self.root / "sub" / "deeper").resolve()]),
+                         [str(self.root / "file1"), str(self.root / "sub" / "file2")])
+    def test_walk_symlinks(self):
+        (self.root / "link_to_file").symlink_to(self.root / "file1")
+        (self.root / "link_to_dir").symlink_to(self.root / "sub", target_is_directory=True)
+        paths = self.paths()
+        # Symlinked files are listed, symlinked directories aren't followed
+        self.assertIn(str(self.root / "link_to_file"), paths)
+        self.assertFalse(any(path.startswith(str(self.root / "link_to_dir")) for path in paths))
+        # A symlinked file pointing into an ignored directory is skipped
+        (self.root / "link_to_file3").symlink_to(self.root / "sub" / "deeper" / "file3")
+        self.assertNotIn(str(self.root / "link_to_file3"), self.paths([(self.root / "sub" / "deeper").resolve()]))
+    def test_undecodable_filename(self):
+        # os.scandir gives a name that isn't valid UTF-8 back with surrogate escapes
+        file = self.root / os.fsdecode(b"caf\xe9.txt")
+        file.write_text("4")
+        self.assertEqual(run_indexer("index", str(self.root)).returncode, 0)
+        result = run_indexer("validate", str(self.root), "--script")
+        self.assertEqual(result.returncode, 0)
+        self.assertNotIn(str(file), result.stdout)
+
+class TestHashAlgos(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_dir_path = Path(self.temp_dir.name)
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    def reference(self, hash_algo, data):
+        if hash_algo == 'blake3':
+            import blake3
+            return blake3.blake3(data).hexdigest()
+        if hash_algo == 'xxh128':
+            import xxhash
+            return xxhash.xxh3_128_hexdigest(data)
+        return hashlib.new(hash_algo, data).hexdigest()
+    def check_algos(self):
+        # Algorithm -> the optional package it needs
+        for hash_algo, package in [('sha1', None), ('sha256', None), ('blake3', 'blake3'), ('xxh128', 'xxhash')]:
+            with self.subTest(hash_algo=hash_algo):
+                if package and importlib.util.find_spec(package) is None:
+                    self.skipTest(f"{package} package not installed")
+                for name, data in [("empty", b""), ("data", os.urandom(100000))]:
+                    file = self.temp_dir_path / name
+                    file.write_bytes(data)
+                    self.assertEqual(file_checksum(file, hash_algo), self.reference(hash_algo, data))
+    def test_file_checksum(self):
+        self.check_algos()
+    def test_file_checksum_mmap(self):
+        # The mmap fallback of Pythons without hashlib.file_digest
+        with mock.patch('indexer.HAS_FILE_DIGEST', False):
+            self.check_algos()
+    def test_index_hash_option(self):
+        (self.temp_dir_path / "file1").write_text("hello world")
+        result = run_indexer("index", str(self.temp_dir_path), "--hash", "sha256")
+        self.assertEqual(result.returncode, 0)
+        self.assertTrue((self.temp_dir_path / ".index_sha256").exists())
+        self.assertFalse((self.temp_dir_path / ".index").exists())
+        index = json.loads((self.temp_dir_path / ".index_sha256").read_text())
+        self.assertEqual(index, {hashlib.sha256(b"hello world").hexdigest(): [str(self.temp_dir_path / "file1")]})
+
+class TestSha1Tree(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file = Path(self.temp_dir.name) / "file1"
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    def test_sha1_tree_blocks(self):
+        data = os.urandom(3500)
+        self.file.write_bytes(data)
+        digests = b"".join(hashlib.sha1(data[i:i + 1000]).digest() for i in range(0, len(data), 1000))
+        with mock.patch('indexer.TREE_BLOCK', 1000):
+            self.assertEqual(file_checksum(self.file, 'sha1-tree'), hashlib.sha1(digests).hexdigest())
+    def test_sha1_tree_empty(self):
+        self.file.write_bytes(b"")
+        self.assertEqual(file_checksum(self.file, 'sha1-tree'), hashlib.sha1().hexdigest())
 class TestContentChange(unittest.TestCase):
     def setUp(self):
         self.temp_dir = tempfile.TemporaryDirectory()
@@ -214,21 +445,15 @@ class TestContentChange(unittest.TestCase):
         file1.write_text("hello world")
         file2.write_text("test test")
         file3.write_text("test")
-        file4.write_text("test"*4096*4096)
-        file5.write_text("tst"*4096*4096)
-        file6.write_text("tst"*4096*4096)
+        make_file(file4, 4*4096*4096, b"test")
+        make_file(file5, 3*4096*4096, b"tst")
+        make_file(file6, 3*4096*4096, b"tst")
 
-        result = subprocess.run(
-            ["python3", "indexer.py", "index", str(self.temp_dir_path)],
-            capture_output=True, text=True
-        )
+        result = run_indexer("index", str(self.temp_dir_path))
         
         file1.write_text("hhhhello world")
 
-        result = subprocess.run(
-            ["python3", "indexer.py", "validate", str(self.temp_dir_path), "--script"],
-            capture_output=True, text=True
-        )
+        result = run_indexer("validate", str(self.temp_dir_path), "--script")
 
         print(result.stdout)
         # Check if the output is correct
@@ -264,20 +489,14 @@ class TestDuplicateRemoval(unittest.TestCase):
         file2.write_text("test test")
         file3.write_text("test")
         file4.write_text("test") # Duplicate of file3
-        file5.write_text("tst"*4096*4096)
-        file6.write_text("tst"*4096*4096)
+        make_file(file5, 3*4096*4096, b"tst")
+        make_file(file6, 3*4096*4096, b"tst")
 
-        result = subprocess.run(
-            ["python3", "indexer.py", "index", str(self.temp_dir_path)],
-            capture_output=True, text=True
-        )
+        result = run_indexer("index", str(self.temp_dir_path))
         
         file4.unlink()
 
-        result = subprocess.run(
-            ["python3", "indexer.py", "validate", str(self.temp_dir_path), "--script"],
-            capture_output=True, text=True
-        )
+        result = run_indexer("validate", str(self.temp_dir_path), "--script")
 
         print(result.stdout)
         # Check if the output is correct
@@ -286,6 +505,112 @@ class TestDuplicateRemoval(unittest.TestCase):
             self.assertNotIn(f"{str(file)}", result.stdout)
         self.assertEqual(result.returncode, 0)
 
+class TestDuplicateScan(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_dir2 = tempfile.TemporaryDirectory(dir=self.temp_dir.name)
+        self.temp_dir_path = Path(self.temp_dir.name)
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    def test_process_file(self):
+        file1 = Path(self.temp_dir.name) / "file1"
+        file2 = Path(self.temp_dir.name) / "file2"
+        file3 = Path(self.temp_dir2.name) / "file3"
+        file4 = Path(self.temp_dir2.name) / "file4"
+        file1.write_text("hello world")
+        file2.write_text("hello there") # Same size as file1, different contents
+        file3.write_text("hello world") # Duplicate of file1
+        file4.write_text("unique")
+
+        result = run_indexer("duplicate-info", str(self.temp_dir_path), "--scan")
+
+        print(result.stdout)
+        self.assertIn(f"Duplicates: {str(file1)}, {str(file3)}", result.stdout)
+        for file in [file2, file4]:
+            self.assertNotIn(f"{str(file)}", result.stdout)
+        self.assertEqual(result.returncode, 0)
+
+    def test_same_size_different_head(self):
+        file1 = Path(self.temp_dir.name) / "file1"
+        file2 = Path(self.temp_dir.name) / "file2"
+        file3 = Path(self.temp_dir2.name) / "file3"
+        file1.write_text("a" * 10000)
+        file2.write_text("b" + "a" * 9999) # Same size as file1, differs in the first bytes
+        file3.write_text("a" * 10000) # Duplicate of file1
+
+        with self.assertLogs('indexer', level='INFO') as logs:
+            result = run_indexer("duplicate-info", str(self.temp_dir_path), "--scan")
+
+        self.assertIn(f"Duplicates: {str(file1)}, {str(file3)}", result.stdout)
+        self.assertNotIn(f"{str(file2)}", result.stdout)
+        self.assertTrue(any("2 files share their size and head" in line for line in logs.output))
+        self.assertEqual(result.returncode, 0)
+
+class TestImageHash(unittest.TestCase):
+    # Expected values come from the imagehash based implementation. Existing
+    # .index_dhash files hold these checksums, so they must never change.
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    def pattern_image(self, width, height):
+        import numpy
+        from PIL import Image
+        pixels = [[((x*7 + y*13) % 256, (x*x + y) % 256, (x*y) % 256) for x in range(width)] for y in range(height)]
+        path = Path(self.temp_dir.name) / f"pattern{width}x{height}.png"
+        Image.fromarray(numpy.array(pixels, dtype=numpy.uint8)).save(path)
+        return path
+    def test_bits_to_hex(self):
+        import numpy
+        # Same as str(imagehash.ImageHash(bits)): 25 bits take 7 hex digits
+        bits = (numpy.arange(25).reshape(5, 5) * 7) % 3 == 0
+        self.assertEqual(bits_to_hex(bits), "1249249")
+        bits = (numpy.arange(64).reshape(8, 8) * 7) % 3 == 0
+        self.assertEqual(bits_to_hex(bits), "9249249249249249")
+    def test_dhash(self):
+        # Landscape gets turned upright first; both have distinct 0 and 180 degree halves
+        self.assertEqual(dhash(self.pattern_image(40, 30)), "0c20a281d75f79")
+        self.assertEqual(dhash(self.pattern_image(30, 40)), "04e52941ad6b1b")
+
+class TestImageCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_dir_path = Path(self.temp_dir.name)
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    def test_process_file(self):
+        from PIL import Image
+        image = self.temp_dir_path / "img.png"
+        Image.new('RGB', (40, 30), (10, 200, 30)).save(image)
+        image_cache = {}
+        # Nothing cached yet: images aren't looked up, workers fill the cache
+        with mock.patch('indexer.image_key', side_effect=AssertionError("looked up an empty cache")):
+            first, _ = index(self.temp_dir.name, None, None, True, None, image_cache=image_cache)
+        self.assertEqual(image_cache, {sha1sum(image): list(first)[0]})
+
+        # Moved image: no timestamp to reuse, but the cached hash is found by contents
+        moved = self.temp_dir_path / "moved.png"
+        image.rename(moved)
+        image_cache[sha1sum(moved)] = "cached"
+        self.assertEqual(index(self.temp_dir.name, None, None, True, None, image_cache=image_cache)[0], {"cached": [str(moved)]})
+    def test_cache_file(self):
+        from PIL import Image
+        Image.new('RGB', (40, 30), (10, 200, 30)).save(self.temp_dir_path / "img.png")
+        cache = self.temp_dir_path / ".index_cache_dhash"
+        self.assertEqual(run_indexer("index", self.temp_dir.name, "--image-mode").returncode, 0)
+        self.assertTrue(cache.exists())
+        # Validating without writing the index leaves the cache as it was,
+        # and the cache file itself is never reported
+        cache.unlink()
+        result = run_indexer("validate", self.temp_dir.name, "--image-mode", "--script")
+        self.assertEqual(result.returncode, 0)
+        self.assertFalse(cache.exists())
+        self.assertNotIn(".index_cache", result.stdout)
+        with mock.patch('builtins.input', return_value="y"), contextlib.redirect_stdout(io.StringIO()):
+            main(["validate", self.temp_dir.name, "--image-mode"])
+        self.assertTrue(cache.exists())
+        self.assertNotIn(".index_cache", run_indexer("validate", self.temp_dir.name, "--image-mode", "--script").stdout)
+
 class TestContentAndRemoveNestedDirs(unittest.TestCase):
     def setUp(self):
         self.temp_dir = tempfile.TemporaryDirectory()
@@ -304,23 +629,17 @@ class TestContentAndRemoveNestedDirs(unittest.TestCase):
         file1.write_text("hello world")
         file2.write_text("test test")
         file3.write_text("test")
-        file4.write_text("test"*4096*4096)
-        file5.write_text("tst"*4096*4096)
-        file6.write_text("tst"*4096*4096)
+        make_file(file4, 4*4096*4096, b"test")
+        make_file(file5, 3*4096*4096, b"tst")
+        make_file(file6, 3*4096*4096, b"tst")
 
-        result = subprocess.run(
-            ["python3", "indexer.py", "index", str(self.temp_dir_path)],
-            capture_output=True, text=True
-        )
+        result = run_indexer("index", str(self.temp_dir_path))
         
         file2.unlink()
         file3.unlink()
         file4.write_text("t")
 
-        result = subprocess.run(
-            ["python3", "indexer.py", "validate", str(self.temp_dir_path), "--script"],
-            capture_output=True, text=True
-        )
+        result = run_indexer("validate", str(self.temp_dir_path), "--script")
 
         print(result.stdout)
         # Check if the output is correct
@@ -334,8 +653,12 @@ class TestContentAndRemoveNestedDirs(unittest.TestCase):
 class TestContentAndRemoveNestedDirsLarge(unittest.TestCase):
     def setUp(self):
         self.temp_dir = tempfile.TemporaryDirectory()
-        self.nested_dirs_lv1 = [tempfile.TemporaryDirectory(dir=self.temp_dir.name) for i in range(100)]
-        self.nested_dirs_lv2 = [tempfile.TemporaryDirectory(dir=nested_dir.name) for nested_dir in self.nested_dirs_lv1]
+        # Plain directories under the one temporary directory, which removes them all
+        # Spaces in the names keep the parsing of the report below honest
+        self.nested_dirs_lv1 = [os.path.join(self.temp_dir.name, f"lv1 {i}") for i in range(100)]
+        self.nested_dirs_lv2 = [os.path.join(nested_dir, "lv2") for nested_dir in self.nested_dirs_lv1]
+        for nested_dir in self.nested_dirs_lv2:
+            os.makedirs(nested_dir)
         self.temp_dir_path = Path(self.temp_dir.name)
     def tearDown(self):
         self.temp_dir.cleanup()
@@ -345,7 +668,7 @@ class TestContentAndRemoveNestedDirsLarge(unittest.TestCase):
         other_files = []
         for i in range(0,100):
             file = Path(self.temp_dir.name) / f"file{i}"
-            file.write_text(f"test{i}"*(i+1))
+            write_file(file, (f"test{i}"*(i+1)).encode())
             if i % 7 == 0:
                 files_to_unlink.append(file)
             elif i % 8 == 0:
@@ -353,8 +676,8 @@ class TestContentAndRemoveNestedDirsLarge(unittest.TestCase):
             else:
                 other_files.append(file)
         for i in range(0,100):
-            file = Path(self.nested_dirs_lv1[i].name) / f"file{i}"
-            file.write_text(f"test{i}"*(i+1))
+            file = Path(self.nested_dirs_lv1[i]) / f"file{i}"
+            write_file(file, (f"test{i}"*(i+1)).encode())
             if i % 7 == 0:
                 files_to_unlink.append(file)
             elif i % 8 == 0:
@@ -362,8 +685,8 @@ class TestContentAndRemoveNestedDirsLarge(unittest.TestCase):
             else:
                 other_files.append(file)
         for i in range(0,100):
-            file = Path(self.nested_dirs_lv2[i].name) / f"file{i}"
-            file.write_text(f"test{i}"*(i+1))
+            file = Path(self.nested_dirs_lv2[i]) / f"file{i}"
+            write_file(file, (f"test{i}"*(i+1)).encode())
             if i % 7 == 0:
                 files_to_unlink.append(file)
             elif i % 8 == 0:
@@ -371,29 +694,27 @@ class TestContentAndRemoveNestedDirsLarge(unittest.TestCase):
             else:
                 other_files.append(file)
 
-        result = subprocess.run(
-            ["python3", "indexer.py", "index", str(self.temp_dir_path)],
-            capture_output=True, text=True
-        )
+        result = run_indexer("index", str(self.temp_dir_path))
         
         for file in files_to_unlink:
             file.unlink()
         for file in files_to_change:
             file.write_text("overwritten")
 
-        result = subprocess.run(
-            ["python3", "indexer.py", "validate", str(self.temp_dir_path), "--script"],
-            capture_output=True, text=True
-        )
+        result = run_indexer("validate", str(self.temp_dir_path), "--script")
 
         print(result.stdout)
+        # Parse the report once, then check hundreds of files with set lookups
+        # instead of searching the whole output for each of them
+        events = set(re.findall(r"^File (.+?) (was removed|changed its contents|moved to|is new|was copied to)", result.stdout, re.M))
+        mentioned = {path for path, _ in events} | set(re.findall(r"^Duplicated file (.+?) was removed\. Its cop", result.stdout, re.M))
         # Check if the output is correct
         for file in files_to_unlink:
-            self.assertIn(f"File {str(file)} was removed", result.stdout)
+            self.assertIn((str(file), "was removed"), events)
         for file in files_to_change:
-            self.assertIn(f"File {str(file)} changed its contents", result.stdout)
+            self.assertIn((str(file), "changed its contents"), events)
         for file in other_files:
-            self.assertNotIn(f"{str(file)} ", result.stdout)
+            self.assertNotIn(str(file), mentioned)
         self.assertEqual(result.returncode, 0)
 if __name__ == "__main__":
     unittest.main()